@@ -1,15 +1,13 @@
+import asyncio
 import tomli
-import tempfile
-import os
-import shutil
+from functools import lru_cache, partial
 from typing import Optional, Dict, Any
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+import anyio
+from fastapi import APIRouter, FastAPI, UploadFile, File, Form, HTTPException
 from pydantic import BaseModel
-from prefect.deployments import run_deployment
 
-# Import the Prefect flow function
-from pipeline import flow
+from handlers.file_handlers import SourceIdentifier, registered_upload, source_name
 
 # --- Configuration Loading ---
 
@@ -20,8 +18,28 @@ try:
 except FileNotFoundError:
     raise RuntimeError("config.toml not found. Cannot start application.")
 
+# Index the pipeline definitions by endpoint name: endpoint -> (title, source_type)
+PIPELINES = {
+    p["endpoint"]: (p["title"], p["source_type"])
+    for p in config.get("pipeline", [])
+}
+
 app = FastAPI(title="DU-Recall Config-Driven Data Pipeline Service")
 
+# Limit how many uploads are processed at once to avoid RAM/disk thrash
+MAX_CONCURRENT_UPLOADS = 4
+# Largest accepted upload; the whole file is parsed into memory by the pipeline
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def _get_upload_semaphore() -> asyncio.Semaphore:
+    """
+    Returns the upload semaphore, created on first use inside the serving event loop
+    (on Python 3.9 a semaphore binds to the loop current when it is constructed).
+    """
+    return asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+
 
 # Define a Pydantic model for URL ingestion requests
 class UrlIngestRequest(BaseModel):
@@ -32,78 +50,82 @@ class UrlIngestRequest(BaseModel):
 
 # --- Prefect Deployment Helper ---
 
-def trigger_prefect_flow(source_identifier: str, title: str):
-    """Triggers the Prefect flow with the given source identifier."""
-    print(f"Triggering Prefect Flow: '{title}' for source: {source_identifier}")
+@lru_cache(maxsize=None)
+def _get_flow():
+    """
+    Returns the pipeline flow object, resolved once and reused across requests.
+    The import is deferred to the first request to keep Prefect/Dask out of worker startup.
+    """
+    from pipeline import flow
+    return flow.data_pipeline_flow
+
+
+def trigger_prefect_flow(source_identifier: SourceIdentifier, title: str):
+    """
+    Triggers the Prefect flow with the given source identifier (a path/URL or an uploaded file).
+    Blocks until the flow finishes, so call it from a worker thread inside async endpoints.
+    """
+    name = source_name(source_identifier)
+    print(f"Triggering Prefect Flow: '{title}' for source: {name}")
     try:
         # In a real deployed Prefect system, you would typically run a deployment
-        # For this local demo, we call the flow function directly, which respects the DaskRunner setup.
-        flow.data_pipeline_flow(source_identifier=source_identifier)
-        return {"status": "Flow triggered successfully", "source": source_identifier}
+        # For this local demo, we call the flow function directly, which respects its task runner setup.
+        _get_flow()(source_identifiers=[source_identifier])
+        return {"status": "Flow triggered successfully", "source": name}
     except Exception as e:
         # In production, Prefect handles most exceptions, but we catch deployment errors here
         raise HTTPException(status_code=500, detail=f"Failed to trigger flow: {str(e)}")
 
 
-# --- Dynamic Endpoint Creation ---
-
-for pipeline_config in config.get("pipeline", []):
-    endpoint = pipeline_config["endpoint"]
-    title = pipeline_config["title"]
-    source_type = pipeline_config["source_type"]
-
-    if source_type == "file":
-        # Endpoint for FILE UPLOAD pipelines
-
-        # Use a closure to capture variables for the function definition
-        def create_file_endpoint(title, endpoint):
+# --- Pipeline Endpoint Handlers ---
 
-            async def file_endpoint(file: UploadFile = File(...),
-                                    metadata: Optional[str] = Form(None)):
-                """Ingest data via file upload and run the pipeline."""
-                temp_dir = tempfile.mkdtemp()
-                temp_file_path = os.path.join(temp_dir, file.filename)
+async def _file_handler(title: str, file: UploadFile = File(...), metadata: Optional[str] = Form(None)):
+    """Ingest data via file upload and run the pipeline."""
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit.")
+    async with _get_upload_semaphore():
+        # The upload is already spooled by Starlette (in memory while small, on disk beyond that),
+        # so the flow reads it in place through a handle instead of a copy
+        with registered_upload(file.filename, file.file) as upload:
+            # Trigger the Prefect flow with the uploaded file (off the event loop)
+            result = await anyio.to_thread.run_sync(
+                lambda: trigger_prefect_flow(source_identifier=upload, title=title)
+            )
+    return result
 
-                try:
-                    # Save the uploaded file to a temporary location
-                    with open(temp_file_path, "wb") as buffer:
-                        shutil.copyfileobj(file.file, buffer)
 
-                    # Trigger the Prefect flow with the temporary file path
-                    result = trigger_prefect_flow(source_identifier=temp_file_path, title=title)
-                    return result
+async def _url_handler(title: str, request: UrlIngestRequest):
+    """Ingest data via URL and run the pipeline."""
+    url = request.url
+    # Trigger the Prefect flow with the URL as the source identifier (off the event loop)
+    result = await anyio.to_thread.run_sync(
+        lambda: trigger_prefect_flow(source_identifier=url, title=title)
+    )
+    return result
 
-                finally:
-                    # Clean up the temporary directory and file
-                    if os.path.exists(temp_dir):
-                        shutil.rmtree(temp_dir)
 
-            file_endpoint.__name__ = f"{endpoint}_file_handler"
-            file_endpoint.__doc__ = f"**{title}**: Accepts a file upload to start the processing pipeline."
-            app.post(f"/{endpoint}", name=endpoint, summary=title)(file_endpoint)
+# --- Dynamic Endpoint Creation ---
 
+# Every pipeline endpoint shares one of the two handlers above, with its title bound via functools.partial
+router = APIRouter()
 
-        create_file_endpoint(title, endpoint)
+for endpoint, (title, source_type) in PIPELINES.items():
+    # File uploads are the most common pipeline type, so check them first
+    if source_type == "file":
+        # Endpoint for FILE UPLOAD pipelines
+        router.add_api_route(
+            f"/{endpoint}", partial(_file_handler, title), methods=["POST"], name=endpoint, summary=title,
+            description=f"**{title}**: Accepts a file upload to start the processing pipeline.",
+        )
 
     elif source_type == "url":
         # Endpoint for URL INGESTION pipelines
-
-        # Use a closure to capture variables for the function definition
-        def create_url_endpoint(title, endpoint):
-
-            async def url_endpoint(request: UrlIngestRequest):
-                """Ingest data via URL and run the pipeline."""
-                url = request.url
-                # Trigger the Prefect flow with the URL as the source identifier
-                result = trigger_prefect_flow(source_identifier=url, title=title)
-                return result
-
-            url_endpoint.__name__ = f"{endpoint}_url_handler"
-            url_endpoint.__doc__ = f"**{title}**: Accepts a URL to start the processing pipeline."
-            app.post(f"/{endpoint}", name=endpoint, summary=title)(url_endpoint)
-
-
-        create_url_endpoint(title, endpoint)
+        router.add_api_route(
+            f"/{endpoint}", partial(_url_handler, title), methods=["POST"], name=endpoint, summary=title,
+            description=f"**{title}**: Accepts a URL to start the processing pipeline.",
+        )
 
     else:
         print(f"Warning: Unknown source_type '{source_type}' for endpoint '{endpoint}'. Skipping.")
+
+app.include_router(router)
@@ -1,18 +1,58 @@
 import abc
-import pandas as pd
-from typing import List, Dict, Any, Union
-from urllib.parse import urlparse
+import os
+import re
+import uuid
+from contextlib import contextmanager
+import pyarrow as pa
+from pyarrow import csv as pacsv
+from typing import List, Dict, Any, BinaryIO, Iterator, NamedTuple, Union, Type
 
 # Define a type alias for the core data format used throughout the pipeline
 ProcessedData = List[Dict[str, Any]]
 
 
+class UploadedFile(NamedTuple):
+    """
+    A handle to an open upload, passed to the pipeline in place of a path. Only the
+    filename and id travel as the flow parameter; the file itself stays in the process
+    that registered it (see registered_upload).
+    """
+    filename: str
+    upload_id: str
+
+
+# Open upload files by upload id, while their request is being processed
+_UPLOADS: Dict[str, BinaryIO] = {}
+
+
+@contextmanager
+def registered_upload(filename: str, file: BinaryIO) -> Iterator[UploadedFile]:
+    """Registers an open upload file for the duration of the block and yields its handle."""
+    upload = UploadedFile(filename=filename, upload_id=uuid.uuid4().hex)
+    _UPLOADS[upload.upload_id] = file
+    try:
+        yield upload
+    finally:
+        del _UPLOADS[upload.upload_id]
+
+
+# A source is either a path/URL string or a handle to an uploaded file
+SourceIdentifier = Union[str, UploadedFile]
+
+
+def source_name(source_identifier: SourceIdentifier) -> str:
+    """Returns the path, URL or upload filename that identifies a source in logs and metadata."""
+    if isinstance(source_identifier, UploadedFile):
+        return source_identifier.filename
+    return source_identifier
+
+
 # --- Core Handler Interface ---
 
 class FileHandler(abc.ABC):
     """Abstract Base Class for all file and source handlers."""
 
-    def __init__(self, source_identifier: str):
+    def __init__(self, source_identifier: SourceIdentifier):
         self.source_identifier = source_identifier
 
     @abc.abstractmethod
@@ -33,25 +73,34 @@ class FileHandler(abc.ABC):
 
     def get_metadata(self) -> Dict[str, Any]:
         """Returns metadata about the source."""
-        return {"source_type": self.__class__.__name__, "path_or_url": self.source_identifier}
+        return {"source_type": self.__class__.__name__, "path_or_url": source_name(self.source_identifier)}
 
 
 # --- Concrete Handler Implementations ---
 
 class CSVFileHandler(FileHandler):
-    """Handles local CSV files."""
+    """Handles local CSV files and uploaded CSV files."""
+
+    # Read options for Arrow's multithreaded CSV reader
+    READ_OPTIONS = pacsv.ReadOptions(use_threads=True, block_size=1 << 20)
 
     def parse(self) -> ProcessedData:
-        print(f"  [Handler] Reading CSV file at: {self.source_identifier}")
+        print(f"  [Handler] Reading CSV file at: {source_name(self.source_identifier)}")
         try:
+            source = self.source_identifier
+            if isinstance(source, UploadedFile):
+                # Read the upload's (spooled) file directly; an earlier retried attempt may have read it
+                source = _UPLOADS[source.upload_id]
+                source.seek(0)
+
             # Assumes CSV has columns like 'id', 'raw_text', etc.
-            df = pd.read_csv(self.source_identifier)
+            table = pacsv.read_csv(source, read_options=self.READ_OPTIONS)
             # Ensure an 'id' column exists, or create a synthetic one
-            if 'id' not in df.columns:
-                df['id'] = range(1, len(df) + 1)
+            if 'id' not in table.column_names:
+                table = table.append_column('id', pa.array(range(1, table.num_rows + 1)))
 
-            # Convert to standard Python list of dictionaries
-            return df.to_dict('records')
+            # Convert to standard Python list of dictionaries (native Python scalars, built in C++)
+            return table.to_pylist()
         except Exception as e:
             print(f"  [Handler Error] Failed to read CSV: {e}")
             return []
@@ -120,26 +169,29 @@ class TrustfallWebHandler(FileHandler):
 
 # --- Handler Factory ---
 
+# Only http(s) URLs are routed to the web handler; everything else is a local path
+_URL_RE = re.compile(r'^https?://', re.IGNORECASE)
+
+
 def is_url(source_identifier: str) -> bool:
-    """Checks if the source identifier is a valid URL."""
-    try:
-        result = urlparse(source_identifier)
-        return result.scheme in ['http', 'https']
-    except:
-        return False
+    """Checks if the source identifier is an http(s) URL."""
+    return _URL_RE.match(source_identifier) is not None
 
 
-def get_handler(source_identifier: str) -> FileHandler:
-    """Factory function to return the correct handler based on the source identifier."""
-    if is_url(source_identifier):
-        return TrustfallWebHandler(source_identifier)
+# Handler classes for local files, keyed by lowercase extension.
+# Can be expanded to ExcelHandler, JSONHandler, etc.; for this demo unknown extensions are treated as CSV-like.
+_EXT_MAP: Dict[str, Type[FileHandler]] = {'.csv': CSVFileHandler, '.txt': CSVFileHandler}
 
-    # Simple check for file extension can be added here if needed
-    # For now, treat non-URLs as file paths (e.g., CSV, Excel)
-    elif source_identifier.lower().endswith(('.csv', '.txt')):
-        return CSVFileHandler(source_identifier)
 
-    # Default handler for local files (can be expanded to ExcelHandler, JSONHandler, etc.)
-    else:
-        # For simplicity, if it's a file path, we'll assume it's CSV-like for this demo
+def get_handler(source_identifier: SourceIdentifier) -> FileHandler:
+    """Factory function to return the correct handler based on the source identifier."""
+    # Uploads are CSV-like
+    if isinstance(source_identifier, UploadedFile):
         return CSVFileHandler(source_identifier)
+
+    elif is_url(source_identifier):
+        return TrustfallWebHandler(source_identifier)
+
+    # Treat non-URLs as file paths and dispatch on their extension
+    ext = os.path.splitext(source_identifier)[1].lower()
+    return _EXT_MAP.get(ext, CSVFileHandler)(source_identifier)
@@ -1,8 +1,17 @@
+import logging
+import os
+import struct
+import threading
 import time
-from typing import List, Dict, Any, Tuple
+from itertools import islice
+from typing import List, Dict, Any, Set, Tuple, Optional
 # Using rdflib for demonstrating the RDF conversion logic
-from rdflib import Graph, Literal, URIRef
+from rdflib import Literal, URIRef
 from rdflib.namespace import RDF, Namespace, XSD
+from rocksdict import Rdict, Options, WriteBatch
+
+# A single RDF statement: (subject, predicate, object)
+Triple = Tuple[URIRef, URIRef, Any]
 
 # --- RDF Configuration ---
 # Define the Schema.org namespace
@@ -10,58 +19,206 @@ SCHEMA = Namespace("http://schema.org/")
 # Use a custom namespace for the generated analysis reports
 ANALYSIS_NS = Namespace("urn:analysis-reports/")
 
+# Terms used for every record, built once: namespace attribute lookups and
+# URIRef/Literal constructors validate their input on each call.
+_ANALYSIS_PREFIX = str(ANALYSIS_NS)
+RDF_TYPE = RDF.type
+SCHEMA_PRODUCT = SCHEMA.Product
+SCHEMA_REVIEW = SCHEMA.Review
+SCHEMA_RATING = SCHEMA.Rating
+SCHEMA_IN_STOCK = SCHEMA.InStock
+SCHEMA_OUT_OF_STOCK = SCHEMA.OutOfStock
+SCHEMA_DESCRIPTION = SCHEMA.description
+SCHEMA_AVAILABILITY = SCHEMA.availability
+SCHEMA_CATEGORY = SCHEMA.category
+SCHEMA_ITEM_REVIEWED = SCHEMA.itemReviewed
+SCHEMA_REVIEW_BODY = SCHEMA.reviewBody
+SCHEMA_RATING_VALUE = SCHEMA.ratingValue
+SCHEMA_BEST_RATING = SCHEMA.bestRating
+SCHEMA_AGGREGATE_RATING = SCHEMA.aggregateRating
+ANALYSIS_INVENTORY_VELOCITY = ANALYSIS_NS.inventoryVelocity
+XSD_FLOAT = XSD.float
+BEST_RATING_LIT = Literal(5, datatype=XSD_FLOAT)
+
+logger = logging.getLogger(__name__)
+
+
+# --- RocksDB Storage ---
 
-# --- RocksDB Mock ---
+# Location of the RocksDB store. When unset, storage is mocked and nothing is written.
+ROCKSDB_PATH = os.environ.get("DU_RECALL_ROCKSDB_PATH")
+# Batches are written without fsync; the WAL is synced once every this many batches.
+SYNC_EVERY_N_WRITES = 64
+# Column families: interned terms by N3 form (N3 -> id), the reverse mapping (id -> N3)
+# for decoding, and fixed-width (s_id, p_id, o_id) triples
+STRINGS_CF = "strings"
+TERMS_CF = "terms"
+TRIPLES_CF = "triples"
+# Maximum number of term ids kept in memory; misses are looked up in the strings column family
+TERM_CACHE_SIZE = 100_000
 
-def store_rdf_triples(triples: List[Tuple[URIRef, URIRef, Any]]) -> str:
+# Ids are packed big-endian so triple keys sort by subject, then predicate, then object
+_TERM_ID = struct.Struct(">Q")
+_TRIPLE_KEY = struct.Struct(">QQQ")
+
+_store: Optional[Tuple[Rdict, "TermDictionary"]] = None
+_db_lock = threading.Lock()
+_writes_since_sync = 0
+
+
+class TermDictionary:
     """
-    Mocks the storage of RDF triples into a RocksDB instance.
-    In a real scenario, this would use pyrocksdb with a custom index
-    or an embedded triple store built on top of RocksDB.
+    Interns RDF terms (IRIs, blank nodes and literals, by N3 form) as 64-bit ids,
+    so triples can be stored as three integers. Assignments are persisted in the
+    strings and terms column families; a bounded cache holds recently used ids.
     """
-    print(f"      [RocksDB Mock] Persisting {len(triples)} triples...")
-    time.sleep(0.1)  # Simulate storage latency
 
-    # In a real implementation:
-    # db.put(subject_key, subject_data)
-    # db.put(predicate_key, predicate_data)
+    def __init__(self, db: Rdict):
+        self._db = db
+        self._strings = db.get_column_family(STRINGS_CF)
+        self._terms = db.get_column_family(TERMS_CF)
+        self._strings_handle = db.get_column_family_handle(STRINGS_CF)
+        self._terms_handle = db.get_column_family_handle(TERMS_CF)
+        self._cache: Dict[str, int] = {}
+        # Ids are assigned in order, so the last key in the terms column family is the largest
+        it = self._terms.iter()
+        it.seek_to_last()
+        self._next_id = (_TERM_ID.unpack(it.key())[0] if it.valid() else 0) + 1
+        self._lock = threading.Lock()
+
+    def intern(self, terms: Set[Any]) -> Dict[Any, int]:
+        """
+        Returns the ids of the given terms. Ids for new terms are committed to the store
+        before any of them is handed out, so a stored triple never refers to an id that
+        was not persisted.
+        """
+        keys = {term: term.n3() for term in terms}
+        ids = {key: self._cache.get(key) for key in set(keys.values())}
+        misses = sorted(key for key, term_id in ids.items() if term_id is None)
+        if misses:
+            # Held across the lookup and the write, so a term is never assigned two ids
+            with self._lock:
+                stored = self._strings.get([key.encode("utf-8") for key in misses])
+                new_keys = []
+                for key, value in zip(misses, stored):
+                    if value is None:
+                        new_keys.append(key)
+                    else:
+                        ids[key] = _TERM_ID.unpack(value)[0]
+                if new_keys:
+                    batch = WriteBatch(raw_mode=True)
+                    for i, key in enumerate(new_keys):
+                        term_id = _TERM_ID.pack(self._next_id + i)
+                        batch.put(key.encode("utf-8"), term_id, self._strings_handle)
+                        batch.put(term_id, key.encode("utf-8"), self._terms_handle)
+                    # If the write fails, nothing has been assigned and the ids are reused next time
+                    self._db.write(batch)
+                    ids.update((key, self._next_id + i) for i, key in enumerate(new_keys))
+                    self._next_id += len(new_keys)
+            self._remember({key: ids[key] for key in misses})
+        return {term: ids[key] for term, key in keys.items()}
+
+    def lookup(self, term_id: int) -> Optional[str]:
+        """Returns the N3 form of the term with the given id, or None if it is unknown."""
+        value = self._terms.get(_TERM_ID.pack(term_id))
+        return value.decode("utf-8") if value is not None else None
+
+    def _remember(self, ids: Dict[str, int]) -> None:
+        """Caches term ids, evicting the oldest entries beyond TERM_CACHE_SIZE."""
+        self._cache.update(ids)
+        for key in list(islice(self._cache, max(0, len(self._cache) - TERM_CACHE_SIZE))):
+            self._cache.pop(key, None)
+
+
+def _open_store() -> Optional[Tuple[Rdict, TermDictionary]]:
+    """Opens the RocksDB store on first use. Returns None when no path is configured."""
+    global _store
+    if ROCKSDB_PATH is None:
+        return None
+    with _db_lock:
+        if _store is None:
+            options = Options(raw_mode=True)
+            options.create_missing_column_families(True)
+            db = Rdict(ROCKSDB_PATH, options, column_families={
+                STRINGS_CF: Options(raw_mode=True),
+                TERMS_CF: Options(raw_mode=True),
+                TRIPLES_CF: Options(raw_mode=True),
+            })
+            _store = (db, TermDictionary(db))
+        return _store
+
+
+def close_store() -> None:
+    """Closes the RocksDB store if it is open; the next write reopens it."""
+    global _store
+    with _db_lock:
+        if _store is not None:
+            _store[0].close()
+            _store = None
+
+
+def _sync_wal_periodically(db: Rdict) -> None:
+    """Fsyncs the write-ahead log every SYNC_EVERY_N_WRITES batch writes."""
+    global _writes_since_sync
+    with _db_lock:
+        _writes_since_sync += 1
+        if _writes_since_sync < SYNC_EVERY_N_WRITES:
+            return
+        _writes_since_sync = 0
+    db.flush_wal(True)
+
+
+def _to_ntriples(triple: Triple) -> str:
+    """Formats a triple as an N-Triples statement, without the terminating ' .'."""
+    s, p, o = triple
+    return f"{s.n3()} {p.n3()} {o.n3()}"
+
+
+def store_rdf_triples(triples: List[Triple]) -> str:
+    """
+    Stores RDF triples in RocksDB with a single batched write, as 24-byte keys of
+    interned (subject, predicate, object) ids. If DU_RECALL_ROCKSDB_PATH is not set,
+    the write is mocked.
+    """
+    print(f"      [RocksDB] Persisting {len(triples)} triples...")
 
     # Check if any triples were generated
-    if triples:
-        # Print a snippet of the generated data for verification
-        print("      [RocksDB Mock] First 2 triples stored (TTL format snippet):")
+    if not triples:
+        return "No triples generated to store."
 
-        # Create a temporary graph to serialize for display purposes only
-        g = Graph()
-        for s, p, o in triples:
-            g.add((s, p, o))
-
-        # Print a formatted subset of the triples
-        output = g.serialize(format='turtle').splitlines()
-        count = 0
-        for line in output:
-            if line and not line.startswith("@"):
-                print(f"        {line.strip()}")
-                count += 1
-                if count >= 10: break
-
-        return f"Successfully stored {len(triples)} triples to RocksDB."
+    store = _open_store()
+    if store is None:
+        time.sleep(0.1)  # Simulate storage latency
     else:
-        return "No triples generated to store."
+        db, terms = store
+        triples_cf = db.get_column_family_handle(TRIPLES_CF)
+        ids = terms.intern({term for triple in triples for term in triple})
+        # One WriteBatch commits every triple at once, instead of paying the write latency per triple
+        batch = WriteBatch(raw_mode=True)
+        for s, p, o in triples:
+            batch.put(_TRIPLE_KEY.pack(ids[s], ids[p], ids[o]), b"", triples_cf)
+        db.write(batch)
+        _sync_wal_periodically(db)
+
+    # Print a snippet of the generated data for verification (debug only)
+    if logger.isEnabledFor(logging.DEBUG):
+        print("      [RocksDB] First triples stored (N-Triples snippet):")
+        for triple in triples[:10]:
+            print(f"        {_to_ntriples(triple)} .")
+
+    return f"Successfully stored {len(triples)} triples to RocksDB."
 
 
 # --- RDF Conversion Logic (Schema.org) ---
 
-def convert_to_rdf(final_data: List[Dict[str, Any]]) -> List[Tuple[URIRef, URIRef, Any]]:
+def convert_to_rdf(final_data: List[Dict[str, Any]]) -> List[Triple]:
     """
     Converts the final, processed data (after Dask/LLM) into Schema.org-based
     RDF triples. Uses e-commerce vocabulary.
     """
-    g = Graph()
-
-    # Bind namespaces for clean output
-    g.bind("schema", SCHEMA)
-    g.bind("analysis", ANALYSIS_NS)
+    # Emit triples straight into a list; nothing queries them, so a Graph's indexes are wasted work
+    triples = []
+    add = triples.append
 
     for record in final_data:
         record_id = record.get('id')
@@ -70,33 +227,33 @@ def convert_to_rdf(final_data: List[Dict[str, Any]]) -> List[Tuple[URIRef, URIRe
 
         # 1. Define Subject URI for the core entity being analyzed (Schema.org Product)
         # We use the unique 'id' from the ingestion step to create a unique identifier
-        product_uri = ANALYSIS_NS[f"Product_{record_id}"]
+        product_uri = URIRef(_ANALYSIS_PREFIX + "Product_" + str(record_id))
 
         # Add the core type
-        g.add((product_uri, RDF.type, SCHEMA.Product))
+        add((product_uri, RDF_TYPE, SCHEMA_PRODUCT))
 
         # 2. Add E-commerce Metadata
         if 'raw_text' in record:
             # Map the raw data source to a description or a textual entity
-            g.add((product_uri, SCHEMA.description, Literal(record['raw_text'])))
+            add((product_uri, SCHEMA_DESCRIPTION, Literal(record['raw_text'])))
 
         if 'in_stock' in record:
             if record['in_stock']:
-                g.add((product_uri, SCHEMA.availability, SCHEMA.InStock))
+                add((product_uri, SCHEMA_AVAILABILITY, SCHEMA_IN_STOCK))
             else:
-                g.add((product_uri, SCHEMA.availability, SCHEMA.OutOfStock))
+                add((product_uri, SCHEMA_AVAILABILITY, SCHEMA_OUT_OF_STOCK))
 
         # 3. Incorporate LLM Analysis Results (Classification)
         classification = record.get('llm_classification')
         if classification:
             # Map the classification to a category
-            g.add((product_uri, SCHEMA.category, Literal(classification)))
+            add((product_uri, SCHEMA_CATEGORY, Literal(classification)))
 
             # Create an associated Review/Rating entity for structured analysis data
-            review_uri = ANALYSIS_NS[f"Review_{record_id}"]
-            g.add((review_uri, RDF.type, SCHEMA.Review))
-            g.add((review_uri, SCHEMA.itemReviewed, product_uri))
-            g.add((review_uri, SCHEMA.reviewBody, Literal(f"LLM insight: {classification}")))
+            review_uri = URIRef(_ANALYSIS_PREFIX + "Review_" + str(record_id))
+            add((review_uri, RDF_TYPE, SCHEMA_REVIEW))
+            add((review_uri, SCHEMA_ITEM_REVIEWED, product_uri))
+            add((review_uri, SCHEMA_REVIEW_BODY, Literal(f"LLM insight: {classification}")))
 
         # 4. Incorporate Dask/Numerical Analysis Results
         velocity = record.get('inventory_velocity')
@@ -104,18 +261,18 @@ def convert_to_rdf(final_data: List[Dict[str, Any]]) -> List[Tuple[URIRef, URIRe
 
         if velocity is not None:
             # Map a numerical score like inventory velocity to a property
-            g.add((product_uri, ANALYSIS_NS.inventoryVelocity, Literal(velocity, datatype=XSD.float)))
+            add((product_uri, ANALYSIS_INVENTORY_VELOCITY, Literal(velocity, datatype=XSD_FLOAT)))
 
         if priority is not None:
             # Map the derived priority score to an Aggregate Rating value (5-star scale for simplicity)
             # We treat the priority score (0-5) as the ratingValue
-            rating_uri = ANALYSIS_NS[f"Rating_{record_id}"]
-            g.add((rating_uri, RDF.type, SCHEMA.Rating))
-            g.add((rating_uri, SCHEMA.ratingValue, Literal(round(priority, 1), datatype=XSD.float)))
-            g.add((rating_uri, SCHEMA.bestRating, Literal(5, datatype=XSD.float)))
+            rating_uri = URIRef(_ANALYSIS_PREFIX + "Rating_" + str(record_id))
+            add((rating_uri, RDF_TYPE, SCHEMA_RATING))
+            add((rating_uri, SCHEMA_RATING_VALUE, Literal(round(priority, 1), datatype=XSD_FLOAT)))
+            add((rating_uri, SCHEMA_BEST_RATING, BEST_RATING_LIT))
 
             # Link the rating back to the product
-            g.add((product_uri, SCHEMA.aggregateRating, rating_uri))
+            add((product_uri, SCHEMA_AGGREGATE_RATING, rating_uri))
 
     # Return the triples as a list for the mock storage function to process
-    return list(g.triples((None, None, None)))
+    return triples
@@ -1,11 +1,44 @@
+import asyncio
+import os
 import time
-from typing import Dict, Any, List, Tuple
-import pandas as pd
-from prefect import flow, task
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Any, List, Tuple, AsyncIterator, Deque
+from prefect import flow, task, unmapped
+from prefect.task_runners import ConcurrentTaskRunner
+import dask.dataframe as dd
 import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
 # Import external modules
-from handlers.file_handlers import get_handler, ProcessedData
+from handlers.file_handlers import get_handler, source_name, ProcessedData, SourceIdentifier
+from handlers.rdf_storage import convert_to_rdf, store_rdf_triples, Triple
+
+# Number of records carried through classification, analysis and RDF conversion together
+STREAM_BATCH_SIZE = 4_096
+# Number of batch classifications running ahead of analysis; bounds how many batches are alive at once
+MAX_INFLIGHT_CLASSIFICATIONS = 4
+# Number of records those classifications may hold between them; larger batches get fewer in flight
+MAX_INFLIGHT_RECORDS = MAX_INFLIGHT_CLASSIFICATIONS * STREAM_BATCH_SIZE
+# Number of triples persisted per RocksDB write
+STORE_CHUNK_SIZE = 10_000
+# Integer codes for the 'llm_classification' labels, as used to index PRIORITY_LUT
+PRODUCT_REVIEW, DETAILED_SPEC, LONG_REPORT, OTHER_CLASSIFICATION = 0, 1, 2, 3
+CLASSIFICATION_CODES = {'ProductReview': PRODUCT_REVIEW, 'DetailedSpec': DETAILED_SPEC, 'LongReport': LONG_REPORT}
+# Operational Priority Score (0-5) for each (classification code, in_stock) pair, indexed by
+# (code << 1) | in_stock. High priority for detailed specs, +1 when out of stock (critical data,
+# high attention); medium priority for reviews, +1 when in stock (check needed).
+PRIORITY_LUT = np.array([
+    2.0, 3.0,  # ProductReview: out of stock, in stock
+    5.0, 4.0,  # DetailedSpec
+    0.0, 0.0,  # LongReport
+    0.0, 0.0,  # other
+], dtype=np.float32)
+# Below this many records, Dask's scheduling overhead outweighs parallel scoring.
+# Inputs at least this large are streamed in batches of this size (see _stream_batch_size).
+DASK_MIN_RECORDS = 100_000
 
 
 # --- MOCK Haystack Components for Demo ---
@@ -20,25 +53,21 @@ class MockHaystackDocument:
 class MockHaystackClassifier:
     """Mock for a Haystack node (e.g., a custom classification node)."""
 
-    def run(self, documents: List[MockHaystackDocument], **kwargs) -> Tuple[Dict[str, Any], str]:
-        results = []
-        for doc in documents:
-            # Classification Logic Mock:
-            content_len = len(doc.content)
-            classification_label = "ProductReview"
-
-            if content_len > 100:
-                classification_label = "LongReport"
-            elif content_len > 40:
-                classification_label = "DetailedSpec"
+    # Content length thresholds: <= 40 -> ProductReview, <= 100 -> DetailedSpec, longer -> LongReport
+    LENGTH_THRESHOLDS = np.array([40, 100])
+    LABELS = np.array(["ProductReview", "DetailedSpec", "LongReport"], dtype=object)
 
-            # The classification result is added to the metadata
-            new_meta = {**doc.meta, "llm_classification": classification_label}
+    def run(self, documents: List[MockHaystackDocument], **kwargs) -> Tuple[Dict[str, Any], str]:
+        # Classification Logic Mock: bucket every document by content length in one vectorized pass
+        contents = pa.array([doc.content for doc in documents], type=pa.string())
+        content_lens = pc.fill_null(pc.utf8_length(contents), 0).to_numpy()
+        labels = self.LABELS[np.searchsorted(self.LENGTH_THRESHOLDS, content_lens, side="left")]
 
-            results.append({
-                "content": doc.content,
-                "meta": new_meta
-            })
+        # The classification result is added to the metadata
+        results = [
+            {"content": doc.content, "meta": {**doc.meta, "llm_classification": label}}
+            for doc, label in zip(documents, labels)
+        ]
 
         # Haystack nodes return a dictionary structure and a component name
         return {"documents": results}, "MockClassifier"
@@ -50,27 +79,33 @@ class MockHaystackPipeline:
     def __init__(self, nodes: List[MockHaystackClassifier]):
         self.nodes = nodes  # For demonstration
 
-    def run(self, documents: List[MockHaystackDocument], **kwargs) -> Dict[str, Any]:
+    async def run(self, documents: List[MockHaystackDocument], **kwargs) -> Dict[str, Any]:
         """Simulates running the Haystack pipeline."""
         print("--- [Haystack] Mock Pipeline running for classification...")
-        time.sleep(0.5)  # Simulate pipeline latency
+        await asyncio.sleep(0.5)  # Simulate pipeline latency (I/O-bound LLM call)
 
         # In a real scenario, this would chain multiple nodes. Here we run the mock classifier directly.
         output, _ = self.nodes[0].run(documents=documents)
         return output
 
 
+@lru_cache(maxsize=1)
+def _get_classification_pipeline() -> MockHaystackPipeline:
+    """Builds the classification pipeline once and reuses it across task runs."""
+    return MockHaystackPipeline(nodes=[MockHaystackClassifier()])
+
+
 # --- END MOCK ---
 
 
 # --- Prefect Tasks ---
 
 @task(retries=3, retry_delay_seconds=[5, 10, 30])
-def ingest_and_validate(source_identifier: str) -> ProcessedData:
+def ingest_and_validate(source_identifier: SourceIdentifier) -> ProcessedData:
     """
     Ingests data using the appropriate handler and performs initial validation.
     """
-    print(f"\n[TASK] Starting ingestion for: {source_identifier}")
+    print(f"\n[TASK] Starting ingestion for: {source_name(source_identifier)}")
     handler = get_handler(source_identifier)
     data = handler.parse()
 
@@ -82,8 +117,7 @@ def ingest_and_validate(source_identifier: str) -> ProcessedData:
     return data
 
 
-@task(log_prints=True)
-def run_llm_classification(raw_data: ProcessedData) -> ProcessedData:
+async def run_llm_classification(raw_data: ProcessedData) -> ProcessedData:
     """
     Runs a structured Haystack pipeline (e.g., classification or QA) on the raw text data.
     """
@@ -101,12 +135,11 @@ def run_llm_classification(raw_data: ProcessedData) -> ProcessedData:
         print("[LLM] No documents to process. Skipping classification.")
         return raw_data
 
-    # 2. Initialize the Haystack Pipeline
-    classifier_node = MockHaystackClassifier()
-    classification_pipeline = MockHaystackPipeline(nodes=[classifier_node])
+    # 2. Get the (cached) Haystack Pipeline
+    classification_pipeline = _get_classification_pipeline()
 
     # 3. Execute the Haystack Pipeline
-    pipeline_results = classification_pipeline.run(documents=haystack_docs)
+    pipeline_results = await classification_pipeline.run(documents=haystack_docs)
 
     # 4. Process results and merge back into ProcessedData format
     classified_data: ProcessedData = []
@@ -122,103 +155,172 @@ def run_llm_classification(raw_data: ProcessedData) -> ProcessedData:
     return classified_data
 
 
-@task(log_prints=True)
+def _score_records(classification_codes: np.ndarray, in_stock: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Computes the inventory velocity and priority score arrays for the given records' columns."""
+    # --- E-commerce Analysis 1: Calculate Inventory Velocity ---
+    # Mock calculation: velocity is high if in stock and detailed spec (high interest/demand)
+    draws = np.random.default_rng().random(len(classification_codes))
+    is_spec = classification_codes == DETAILED_SPEC
+    velocity = np.where(in_stock & is_spec, draws * 4.0 + 1.0, draws * 1.5)
+
+    # --- E-commerce Analysis 2: Determine Operational Priority Score (0-5) ---
+    # Branchless: one table gather per record
+    priority = PRIORITY_LUT[(classification_codes.astype(np.uint8) << 1) | in_stock.astype(np.uint8)]
+    return velocity, priority
+
+
+def _score_partition(df: pd.DataFrame) -> pd.DataFrame:
+    """Scores a single Dask partition with _score_records."""
+    velocity, priority = _score_records(df['classification_code'].to_numpy(), df['in_stock'].to_numpy())
+    return pd.DataFrame({'inventory_velocity': velocity, 'priority_score': priority}, index=df.index)
+
+
 def run_dask_analysis(data: ProcessedData) -> ProcessedData:
     """
-    Performs complex, parallelizable analysis using Dask (mocked here).
+    Performs complex, parallelizable analysis using Dask.
 
     This analysis now calculates Inventory Velocity and a Priority Score,
-    leveraging the 'llm_classification' field.
+    leveraging the 'llm_classification' field. Inputs of at least
+    DASK_MIN_RECORDS records are partitioned across cores with Dask;
+    smaller inputs are scored directly with NumPy.
     """
     print(f"[DASK] Starting complex analysis on {len(data)} records...")
 
-    # Convert list of dicts to Dask DataFrame via Pandas for parallel operations
-    df = pd.DataFrame(data)
-
-    # --- E-commerce Analysis 1: Calculate Inventory Velocity ---
-    # Mock calculation: velocity is high if in stock and long report (high interest/demand)
-    df['inventory_velocity'] = df.apply(
-        lambda row:
-        (np.random.rand() * 4.0) + 1.0
-        if row.get('in_stock', False) and row.get('llm_classification') == 'DetailedSpec'
-        else (np.random.rand() * 1.5),
-        axis=1
+    # Extract the columns the analysis needs in a single pass over the records
+    n = len(data)
+    classification_codes = np.fromiter(
+        (CLASSIFICATION_CODES.get(record.get('llm_classification'), OTHER_CLASSIFICATION) for record in data),
+        dtype=np.int8, count=n,
     )
+    in_stock = np.fromiter((bool(record.get('in_stock', False)) for record in data), dtype=bool, count=n)
+
+    if n >= DASK_MIN_RECORDS:
+        df = pd.DataFrame({'classification_code': classification_codes, 'in_stock': in_stock})
+        ddf = dd.from_pandas(df, npartitions=max(1, os.cpu_count() or 1))
+        scored = ddf.map_partitions(
+            _score_partition,
+            meta={'inventory_velocity': 'f8', 'priority_score': 'f8'},
+        ).compute(scheduler='threads')
+        velocity = scored['inventory_velocity'].to_numpy()
+        priority = scored['priority_score'].to_numpy()
+    else:
+        velocity, priority = _score_records(classification_codes, in_stock)
 
-    # --- E-commerce Analysis 2: Determine Operational Priority Score (0-5) ---
-    def calculate_priority(row):
-        score = 0
-        classification = row.get('llm_classification', '')
-        in_stock = row.get('in_stock', False)
-
-        # High priority for detailed specs (potential launch/critical data)
-        if classification == 'DetailedSpec':
-            score += 4
-        # Medium priority for reviews (customer sentiment)
-        elif classification == 'ProductReview':
-            score += 2
-
-        # Adjust based on inventory status
-        if in_stock and classification == 'ProductReview':  # In stock product with review -> check needed
-            score += 1
-        elif not in_stock and classification == 'DetailedSpec':  # Critical data, but out of stock -> high attention
-            score += 1
+    time.sleep(0.3)  # Simulate compute time
 
-        # Cap score at 5
-        return min(score / 5.0 * 5.0, 5.0)
+    # Write results back into the existing records (plain Python floats, not numpy scalars)
+    for i, record in enumerate(data):
+        record['inventory_velocity'] = float(velocity[i])
+        record['priority_score'] = float(priority[i])
 
-    df['priority_score'] = df.apply(calculate_priority, axis=1)
+    print(f"[DASK] Analysis complete. Example record keys: {list(data[0].keys())}")
+    return data
 
-    time.sleep(0.3)  # Simulate compute time
 
-    # Convert back to list of dicts
-    final_data = df.to_dict('records')
+async def pipeline_stream(records: ProcessedData, batch_size: int = STREAM_BATCH_SIZE) -> AsyncIterator[Triple]:
+    """
+    Classifies, analyzes and converts records to RDF in a single pass, yielding the triples.
 
-    print(f"[DASK] Analysis complete. Example record keys: {list(final_data[0].keys())}")
-    return final_data
+    Records are split into batches whose (I/O-bound) classifications run up to
+    MAX_INFLIGHT_CLASSIFICATIONS at a time (fewer when the batches would hold more
+    than MAX_INFLIGHT_RECORDS records, but always one), overlapping with the
+    analysis of the batch before them. Batches are analyzed in order, so at most
+    one more batch than that is alive at once.
+    """
+    max_inflight = max(1, min(MAX_INFLIGHT_CLASSIFICATIONS, MAX_INFLIGHT_RECORDS // batch_size))
+    starts = iter(range(0, len(records), batch_size))
+    inflight: Deque[asyncio.Task] = deque()
+
+    def classify_next_batch() -> None:
+        start = next(starts, None)
+        if start is not None:
+            inflight.append(asyncio.create_task(run_llm_classification(records[start:start + batch_size])))
+
+    try:
+        for _ in range(max_inflight):
+            classify_next_batch()
+        while inflight:
+            classified = await inflight.popleft()
+            classify_next_batch()
+            # The analysis is CPU-bound, so keep it off the event loop driving the classifications
+            analyzed = await asyncio.to_thread(run_dask_analysis, classified)
+            for triple in convert_to_rdf(analyzed):
+                yield triple
+    finally:
+        # Don't leave classifications running if the consumer stops early or a batch fails
+        for classification in inflight:
+            classification.cancel()
+
+
+def _stream_batch_size(n_records: int, batch_size: int) -> int:
+    """
+    Returns the batch size to stream n_records with. Inputs large enough for Dask are
+    streamed in batches of at least DASK_MIN_RECORDS, so each batch is partitioned across cores.
+    """
+    if n_records >= DASK_MIN_RECORDS:
+        return max(batch_size, DASK_MIN_RECORDS)
+    return batch_size
+
+
+async def _emit_triples(records: ProcessedData, batch_size: int) -> int:
+    """Drains pipeline_stream into RocksDB, STORE_CHUNK_SIZE triples per write. Returns the number stored."""
+    stored = 0
+    chunk = []
+    async for triple in pipeline_stream(records, batch_size=batch_size):
+        chunk.append(triple)
+        if len(chunk) == STORE_CHUNK_SIZE:
+            await asyncio.to_thread(store_rdf_triples, chunk)
+            stored += len(chunk)
+            chunk = []
+    if chunk:
+        await asyncio.to_thread(store_rdf_triples, chunk)
+        stored += len(chunk)
+    return stored
 
 
 @task(log_prints=True)
-def store_results_to_rocksdb(final_data: ProcessedData) -> str:
+def transform_and_emit(raw_data: ProcessedData, batch_size: int = STREAM_BATCH_SIZE) -> str:
     """
-    Converts final structured data to RDF triples (Schema.org) and stores them in RocksDB.
+    Runs classification, analysis and RDF conversion as one fused pass and stores
+    the resulting triples (Schema.org) in RocksDB, STORE_CHUNK_SIZE triples at a time.
     """
-    print("[STORAGE] Converting to RDF and storing in RocksDB...")
+    print(f"[STREAM] Classifying, analyzing and storing {len(raw_data)} records in a single pass...")
 
-    # 1. Convert to RDF (using rdflib in a real scenario)
-    triples = convert_to_rdf(final_data)
+    stream_batch_size = _stream_batch_size(len(raw_data), batch_size)
+    if stream_batch_size != batch_size:
+        print(f"[STREAM] Using batches of {stream_batch_size} records instead of {batch_size}, "
+              f"so each batch is large enough to score with Dask.")
 
-    # 2. Store using the RocksDB mock
-    store_result = store_rdf_triples(triples)
+    stored = asyncio.run(_emit_triples(raw_data, stream_batch_size))
 
+    store_result = f"Successfully stored {stored} triples to RocksDB." if stored else "No triples generated to store."
     print(f"[STORAGE] Storage complete. Status: {store_result}")
     return store_result
 
 
 # --- Prefect Flow Definition ---
 
-class DaskTaskRunner:
-    pass
-
-
-@flow(name="data-pipeline-flow", task_runner=DaskTaskRunner())
-def data_pipeline_flow(source_identifier: str):
+@flow(name="data-pipeline-flow", task_runner=ConcurrentTaskRunner())
+def data_pipeline_flow(source_identifiers: List[SourceIdentifier], batch_size: int = STREAM_BATCH_SIZE):
     """
     The main orchestration flow for data ingestion, processing, and storage.
-    Uses Dask for parallelizable tasks.
+    Each source is ingested and processed concurrently; large inputs are scored with Dask.
     """
-    print(f"FLOW START: Running pipeline for source: {source_identifier}")
-
-    # 1. Ingestion and Validation
-    raw_data = ingest_and_validate(source_identifier=source_identifier)
+    source_names = [source_name(source_identifier) for source_identifier in source_identifiers]
+    print(f"FLOW START: Running pipeline for {len(source_identifiers)} source(s): {source_names}")
 
-    # 2. LLM Pipeline Execution (Haystack)
-    classified_data = run_llm_classification(raw_data=raw_data)
+    # 1. Ingestion and Validation, one concurrent task run per source
+    raw_data = ingest_and_validate.map(source_identifiers)
 
-    # 3. Distributed Analysis (Dask)
-    analyzed_data = run_dask_analysis(data=classified_data)
+    # 2-4. LLM Pipeline Execution (Haystack), Distributed Analysis (Dask) and Storage,
+    # fused into a single pass over each source's records
+    results = transform_and_emit.map(raw_data, batch_size=unmapped(batch_size))
 
-    # 4. Storage
-    store_results_to_rocksdb(final_data=analyzed_data)
+    # Wait for every source to finish (raises if any of them failed). Ingestion is resolved
+    # first: a failed ingestion leaves its transform pending, which would hide the real error.
+    for ingested in raw_data:
+        ingested.result()
+    for result in results:
+        result.result()
 
-    print(f"FLOW COMPLETE: Successfully processed and stored data from {source_identifier}")
+    print(f"FLOW COMPLETE: Successfully processed and stored data from {source_names}")
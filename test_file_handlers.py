@@ -0,0 +1,26 @@
+import io
+
+from src.handlers import file_handlers
+
+UPLOAD_CSV = b"raw_text,in_stock\nA short review.,True\nA longer product specification.,False\n"
+
+
+def test_uploads_route_to_csv_handler():
+    """Upload handles are parsed as CSV regardless of their filename."""
+    upload = file_handlers.UploadedFile(filename="report.xlsx", upload_id="unused")
+    assert isinstance(file_handlers.get_handler(upload), file_handlers.CSVFileHandler)
+    assert isinstance(file_handlers.get_handler("https://example.com/a.csv"), file_handlers.TrustfallWebHandler)
+
+
+def test_csv_handler_parses_registered_upload():
+    """A registered upload is read in place (twice, as on a retry) and gets synthetic ids."""
+    with file_handlers.registered_upload("products.csv", io.BytesIO(UPLOAD_CSV)) as upload:
+        handler = file_handlers.CSVFileHandler(upload)
+        first, second = handler.parse(), handler.parse()
+
+    assert first == second == [
+        {"raw_text": "A short review.", "in_stock": True, "id": 1},
+        {"raw_text": "A longer product specification.", "in_stock": False, "id": 2},
+    ]
+    assert handler.get_metadata()["path_or_url"] == "products.csv"
+    assert upload.upload_id not in file_handlers._UPLOADS
@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+from rdflib import RDF
+
+from src.pipeline import flow
+
+
+def expected_priority(classification: str, in_stock: bool) -> float:
+    """The original row-wise priority rules that PRIORITY_LUT encodes."""
+    score = 0
+    if classification == 'DetailedSpec':
+        score += 4
+    elif classification == 'ProductReview':
+        score += 2
+    if in_stock and classification == 'ProductReview':
+        score += 1
+    elif not in_stock and classification == 'DetailedSpec':
+        score += 1
+    return min(score / 5.0 * 5.0, 5.0)
+
+
+LABELS = ['ProductReview', 'DetailedSpec', 'LongReport', None]
+
+
+def test_priority_lut_matches_priority_rules():
+    """Every (classification code, in_stock) entry of PRIORITY_LUT matches the original rules."""
+    for label in LABELS:
+        code = flow.CLASSIFICATION_CODES.get(label, flow.OTHER_CLASSIFICATION)
+        for in_stock in (False, True):
+            assert flow.PRIORITY_LUT[(code << 1) | in_stock] == expected_priority(label, in_stock)
+
+
+def test_classifier_length_boundaries():
+    """Lengths up to 40 are reviews, up to 100 detailed specs, and anything longer long reports."""
+    lengths = {40: 'ProductReview', 41: 'DetailedSpec', 100: 'DetailedSpec', 101: 'LongReport'}
+    documents = [flow.MockHaystackDocument(content='x' * length, meta={}) for length in lengths]
+    output, _ = flow.MockHaystackClassifier().run(documents)
+    assert [doc['meta']['llm_classification'] for doc in output['documents']] == list(lengths.values())
+
+
+def test_large_inputs_stream_in_dask_sized_batches():
+    """Inputs past the Dask threshold are batched so run_dask_analysis takes the Dask path."""
+    assert flow._stream_batch_size(100, flow.STREAM_BATCH_SIZE) == flow.STREAM_BATCH_SIZE
+    assert flow._stream_batch_size(flow.DASK_MIN_RECORDS, flow.STREAM_BATCH_SIZE) == flow.DASK_MIN_RECORDS
+
+
+def test_dask_analysis_scores_large_inputs(monkeypatch):
+    """The Dask branch runs for DASK_MIN_RECORDS records and scores every record correctly."""
+    partitions = []
+    score_partition_directly = flow._score_partition
+
+    def score_partition(df):
+        partitions.append(len(df))
+        return score_partition_directly(df)
+
+    monkeypatch.setattr(flow, '_score_partition', score_partition)
+
+    records = [
+        {'id': i, 'llm_classification': LABELS[i % 4], 'in_stock': bool(i // 4 % 2)}
+        for i in range(flow.DASK_MIN_RECORDS)
+    ]
+    flow.run_dask_analysis(records)
+
+    assert sum(partitions) == flow.DASK_MIN_RECORDS
+    for record in records[:8]:
+        assert record['priority_score'] == expected_priority(record['llm_classification'], record['in_stock'])
+    assert all(
+        record['priority_score'] == records[record['id'] % 8]['priority_score'] for record in records
+    )
+
+
+def run_stream(monkeypatch, records, batch_size, classification_delay=0.01, failing_batch=None):
+    """
+    Runs pipeline_stream with stubbed classification and analysis. Returns the triples, the
+    peak number of live classifications, the batches whose classification was cancelled,
+    and the error the stream raised (if any).
+    """
+    live = []
+    peak = [0]
+    cancelled = []
+
+    async def classify(batch):
+        live.append(batch[0]['id'])
+        peak[0] = max(peak[0], len(live))
+        try:
+            await asyncio.sleep(classification_delay)
+            if batch[0]['id'] == failing_batch:
+                raise ValueError("classification failed")
+            # Later batches finish first, so any ordering comes from pipeline_stream itself
+            await asyncio.sleep(classification_delay / (1 + batch[0]['id']))
+        except asyncio.CancelledError:
+            cancelled.append(batch[0]['id'])
+            raise
+        finally:
+            live.remove(batch[0]['id'])
+        return [{**record, 'llm_classification': 'ProductReview'} for record in batch]
+
+    def analyze(batch):
+        return [{**record, 'priority_score': 2.0} for record in batch]
+
+    monkeypatch.setattr(flow, 'run_llm_classification', classify)
+    monkeypatch.setattr(flow, 'run_dask_analysis', analyze)
+
+    triples = []
+
+    async def collect():
+        try:
+            async for triple in flow.pipeline_stream(records, batch_size=batch_size):
+                triples.append(triple)
+        except ValueError as e:
+            # Let the cancellations requested by the stream reach their tasks, and take them
+            # before asyncio.run cancels whatever is left on shutdown
+            await asyncio.sleep(0)
+            return e, list(cancelled)
+        return None, list(cancelled)
+
+    error, cancelled_by_stream = asyncio.run(collect())
+    return triples, peak[0], cancelled_by_stream, error
+
+
+def test_large_batches_classify_one_at_a_time(monkeypatch):
+    """Batches at MAX_INFLIGHT_RECORDS or beyond are classified one at a time."""
+    records = [{'id': i, 'raw_text': 'x'} for i in range(4)]
+    _, peak, _, _ = run_stream(monkeypatch, records, batch_size=1)
+    assert peak == flow.MAX_INFLIGHT_CLASSIFICATIONS
+
+    monkeypatch.setattr(flow, 'MAX_INFLIGHT_RECORDS', 1)
+    _, peak, _, _ = run_stream(monkeypatch, records, batch_size=1)
+    assert peak == 1
+
+
+def test_stream_yields_triples_in_record_order(monkeypatch):
+    """Batches finishing out of order are still emitted in record order, with a bounded window."""
+    records = [{'id': i, 'raw_text': 'x'} for i in range(1, 21)]
+    triples, peak, _, error = run_stream(monkeypatch, records, batch_size=2)
+
+    subjects = [str(s) for s, p, o in triples if p == RDF.type and 'Product_' in str(s)]
+    assert subjects == [f"urn:analysis-reports/Product_{i}" for i in range(1, 21)]
+    assert peak == flow.MAX_INFLIGHT_CLASSIFICATIONS
+    assert error is None
+
+
+def test_stream_cancels_pending_classifications_on_failure(monkeypatch):
+    """A failed batch raises its error and cancels the classifications still running."""
+    records = [{'id': i, 'raw_text': 'x'} for i in range(1, 21)]
+    triples, _, cancelled, error = run_stream(
+        monkeypatch, records, batch_size=2, classification_delay=0.5, failing_batch=3,
+    )
+
+    assert str(error) == "classification failed"
+    # Only the batch before the failed one was emitted
+    assert {str(s) for s, p, o in triples if p == RDF.type and 'Product_' in str(s)} == {
+        "urn:analysis-reports/Product_1", "urn:analysis-reports/Product_2",
+    }
+    # Batches 5 and 7 finished before the failure was reached; batch 9 was still classifying
+    assert cancelled == [9]
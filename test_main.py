@@ -1,5 +1,8 @@
 import os
 import tempfile
+
+import pytest
+
 from src.pipeline import flow
 
 # Create a mock CSV file for testing file ingestion
@@ -30,7 +33,7 @@ def test_pipeline():
     print("\n--- Running Test Case 1: FILE INGESTION ---")
     file_path = create_mock_file(MOCK_CSV_CONTENT)
     try:
-        flow.data_pipeline_flow(source_identifier=file_path)
+        flow.data_pipeline_flow(source_identifiers=[file_path])
     except Exception as e:
         print(f"Test Case 1 FAILED with error: {e}")
     finally:
@@ -42,7 +45,7 @@ def test_pipeline():
     print("\n--- Running Test Case 2: URL INGESTION (Trustfall Mock) ---")
     url_source = "https://www.example.com/ecommerce-report-2025"
     try:
-        flow.data_pipeline_flow(source_identifier=url_source)
+        flow.data_pipeline_flow(source_identifiers=[url_source])
     except Exception as e:
         print(f"Test Case 2 FAILED with error: {e}")
 
@@ -50,5 +53,12 @@ def test_pipeline():
     print("END OF END-TO-END PIPELINE TEST")
     print("==============================================")
 
+def test_failing_source_raises_ingestion_error(monkeypatch):
+    """A source that cannot be ingested fails the flow with the ingestion error itself."""
+    # Skip the retry delays; a missing file fails the same way on every attempt
+    monkeypatch.setattr(flow, "ingest_and_validate", flow.ingest_and_validate.with_options(retries=0))
+    with pytest.raises(ValueError, match="Ingestion failed"):
+        flow.data_pipeline_flow(source_identifiers=["/nonexistent.csv"])
+
 if __name__ == "__main__":
     test_pipeline()
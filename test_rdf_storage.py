@@ -0,0 +1,38 @@
+from rdflib import Literal, URIRef
+
+from src.handlers import rdf_storage
+
+
+def stored_ids(db):
+    """Returns the persisted term ids and triple keys."""
+    strings = dict(db.get_column_family(rdf_storage.STRINGS_CF).items())
+    triples = [rdf_storage._TRIPLE_KEY.unpack(key) for key in db.get_column_family(rdf_storage.TRIPLES_CF).keys()]
+    return strings, triples
+
+
+def test_term_ids_survive_reopen(monkeypatch, tmp_path):
+    """Writing, reopening the store and writing again reuses the persisted term ids."""
+    monkeypatch.setattr(rdf_storage, "ROCKSDB_PATH", str(tmp_path))
+    product = URIRef("urn:analysis-reports/Product_1")
+    triples = [
+        (product, rdf_storage.RDF_TYPE, rdf_storage.SCHEMA_PRODUCT),
+        (product, rdf_storage.SCHEMA_DESCRIPTION, Literal("A product")),
+        (product, rdf_storage.SCHEMA_BEST_RATING, rdf_storage.BEST_RATING_LIT),
+    ]
+    try:
+        rdf_storage.store_rdf_triples(triples)
+        strings, first_triples = stored_ids(rdf_storage._open_store()[0])
+        rdf_storage.close_store()
+
+        rdf_storage.store_rdf_triples(triples)
+        db, terms = rdf_storage._open_store()
+        reopened_strings, second_triples = stored_ids(db)
+        decoded = [tuple(terms.lookup(term_id) for term_id in key) for key in second_triples]
+        del db, terms
+    finally:
+        rdf_storage.close_store()
+
+    # Literals are interned like any other term, so storing the same triples again adds nothing
+    assert reopened_strings == strings
+    assert second_triples == first_triples
+    assert sorted(decoded) == sorted(tuple(term.n3() for term in triple) for triple in triples)